@@ -2,6 +2,14 @@
 
 import numpy as np
 import csv
+import io
+import os
+import time
+import copy
+import collections
+import itertools
+import locale
+import multiprocessing
 import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.lines  as mlines
@@ -74,6 +82,36 @@ class ElectricMotor:
 '''
 
 
+# Versions of catalog data and regression results, unique among all analyzers
+_reg_versions = itertools.count()
+
+
+############################
+def _watch( obj , period , duration , callback ):
+    """ poll obj.update_analysis() every period (sec) until duration """
+    
+    t0 = time.time()
+    
+    while duration is None or time.time() - t0 < duration:
+        
+        if obj.update_analysis() and callback is not None:
+            callback( obj )
+            
+        time.sleep( period )
+        
+        
+############################
+def _state_without( obj , keys ):
+    """ pickling state of obj without the attributes in keys """
+    
+    state = obj.__dict__.copy()
+    
+    for k in keys:
+        state.pop( k , None )
+        
+    return state
+
+
 class MotorAnalyzer:
     """ 
     Class for processing motor data
@@ -82,7 +120,7 @@ class MotorAnalyzer:
     """
     
     ############################
-    def __init__( self , filename = 'data.csv' ):
+    def __init__( self , filename = 'data.csv' , encoding = None ):
         """ """
         
         nm = ElectricMotor()
@@ -90,6 +128,12 @@ class MotorAnalyzer:
         # Copy specs dictionnary
         self.specs = nm.specs
         
+        # Data file encoding, None for locale preferred encoding
+        self.encoding = encoding
+        
+        # Version of catalog data and regression results
+        self.reg_version = next( _reg_versions )
+        
         # Load values from files
         self.load_motors_data( filename )
         
@@ -103,9 +147,19 @@ class MotorAnalyzer:
         self.active_range = [[-1,100000000],[-1,1000000000]]
         
         # Regression Params
-        self.reg_type = 'lin'
+        self.reg_type     = 'lin'  # 'lin', 'quantile' or 'env'
+        self.reg_bins     = 10     # number of bins for 'quantile' and 'env'
+        self.reg_quantile = 0.5    # quantile of param2 in each bin for 'quantile'
+        self.reg_monotone = True   # monotone curve for 'quantile' and 'env', direction from the data
         
     
+    ############################
+    def __getstate__( self ):
+        """ figures are not copied with the analyzer """
+        
+        return _state_without( self , [ 'fig' , 'plot' , 'reg_line' ] )
+    
+    
     ############################
     def process_motor_data(self, row ):
         """ from a list of info, create motor class """
@@ -129,23 +183,85 @@ class MotorAnalyzer:
     
     
     ############################
-    def load_motors_data(self, filename = 'data.csv'  ):
+    def load_motors_data(self, filename = 'data.csv' , partial = True ):
         """ create a list of motors from data"""
         
         self.n          = 0
         self.motor_list = []
+        self.filename   = filename
+        self.file_pos   = 0 # bytes of the file already loaded
         
-        with open( filename , newline='') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                print( 'Loading: ' , row )
-                self.motor_list.append( self.process_motor_data( row ) )
-                self.n = self.n + 1
+        self.load_new_motors_data( partial )
         
         print('Loaded ',self.n,' motors')
         return self.motor_list
     
     
+    ############################
+    def load_new_motors_data(self, partial = False ):
+        """ 
+        append motors from rows added to the file since last loading
+        ---------------------------------------------------------------
+        only the end of the file is read, an incomplete last row is
+        left for the next call unless partial is True, malformed rows
+        are skipped unless partial is True
+        """
+        
+        with open( self.filename , 'rb' ) as f:
+            
+            f.seek( self.file_pos )
+            data = f.read()
+            
+            if not partial:
+                # Last row may still be written
+                data = data[ : data.rfind( b'\n' ) + 1 ]
+                
+            self.file_pos = self.file_pos + len( data )
+            self.file_sig = self.file_signature( f )
+        
+        # Last row loaded may be incomplete
+        self.file_partial = len( data ) > 0 and not data.endswith( b'\n' )
+        
+        new_motors = []
+        
+        encoding = self.encoding or locale.getpreferredencoding( False )
+        
+        reader = csv.reader( io.StringIO( data.decode( encoding ) , newline = '' ) )
+        for row in reader:
+            if row:
+                print( 'Loading: ' , row )
+                try:
+                    new_motors.append( self.process_motor_data( row ) )
+                except ( IndexError , ValueError ):
+                    if partial:
+                        raise
+                    print( 'Skipping malformed row: ' , row )
+        
+        self.motor_list.extend( new_motors )
+        self.n = self.n + len( new_motors )
+        
+        if new_motors:
+            # New catalog data
+            self.reg_version = next( _reg_versions )
+        
+        return new_motors
+    
+    
+    ############################
+    def file_signature(self, f ):
+        """ identity and content boundaries of the loaded part of file f """
+        
+        st = os.fstat( f.fileno() )
+        k  = min( self.file_pos , 1024 )
+        
+        f.seek( 0 )
+        head = f.read( k )
+        f.seek( self.file_pos - k )
+        tail = f.read( k )
+        
+        return ( st.st_ino , st.st_dev , head , tail )
+    
+    
     ############################
     def two_axis_plot( self,  param1 = 'dia' , param2 = 'pow'):
     
@@ -161,6 +277,9 @@ class MotorAnalyzer:
     def two_axis_analysis( self,  param1 = 'dia' , param2 = 'pow' , plot = False , reg = False ):
         """ analyze relationships between two params """
         
+        # Last analysis, for incremental updates
+        self.analysis = ( param1 , param2 , plot , reg )
+        
         # Init lists
         self.x = []
         self.y = []
@@ -196,36 +315,16 @@ class MotorAnalyzer:
                 
         if reg:
             # Conduct regression
-            
-            n = len(self.x)
-            
-            # Regressor
-            X = np.array(self.x)
-            Y = np.array(self.y)
-            
-            if self.reg_type == 'lin':
-                
-                X_0 = np.ones( n ) # constant offset
-                
-                Phi = np.array([ X, X_0])
-                
-                P = np.linalg.inv( np.dot( Phi , Phi.T ) ) 
-                M = np.dot( P , Phi )
-                
-                self.theta = np.dot( M , Y )
-                
-                print('Reg. results: slope=', self.theta[0], ' offset=', self.theta[1])
+            self.compute_regression()
                 
                 
         if plot:
             
             if reg:
                 # Plot regression
-                n = 10
-                x = np.linspace( X.min() , X.max(), num=n)
-                y = self.reg_map(x)
+                x , y = self.reg_curve()
                 
-                plot.plot( x, y, linestyle = '-.', color = 'gray' )
+                self.reg_line = plot.plot( x, y, linestyle = '-.', color = 'gray' )[0]
                 
             # Figure params
             plot.grid(True)
@@ -241,13 +340,223 @@ class MotorAnalyzer:
             fig_name = self.analysis_name + self.specs[param1][1] + ' vs. ' + self.specs[param2][1]
             fig.canvas.set_window_title( fig_name )        
             
+            self.fig_name = fig_name
+            
             if self.save:
-                file_name = self.output_path + fig_name.replace(" ", "_")
-                fig.savefig( file_name + '.png' , format='png', bbox_inches='tight', pad_inches=0.05) 
-                fig.savefig( file_name + '.pdf' , format='pdf', bbox_inches='tight', pad_inches=0.05) 
-                print('Figure {' + fig_name + '} saved')
+                self.save_figure()
                 
                 
+    ############################
+    def save_figure(self):
+        """ save actual figure in png and pdf """
+        
+        fig      = self.fig
+        fig_name = self.fig_name
+        
+        file_name = self.output_path + fig_name.replace(" ", "_")
+        fig.savefig( file_name + '.png' , format='png', bbox_inches='tight', pad_inches=0.05) 
+        fig.savefig( file_name + '.pdf' , format='pdf', bbox_inches='tight', pad_inches=0.05) 
+        print('Figure {' + fig_name + '} saved')
+        
+        
+    ############################
+    def compute_regression(self):
+        """ regression of param2 vs. param1 over the analysis domain """
+        
+        n = len(self.x)
+        
+        # Regressor
+        X = np.array(self.x)
+        Y = np.array(self.y)
+        
+        if self.reg_type == 'lin':
+            
+            X_0 = np.ones( n ) # constant offset
+            
+            Phi = np.array([ X, X_0])
+            
+            # Sufficient statistics, updated with new motors in watch mode
+            self.reg_S  = np.dot( Phi , Phi.T )
+            self.reg_b  = np.dot( Phi , Y )
+            self.reg_yy = np.dot( Y , Y )
+            self.reg_n  = n
+            
+            self.lin_reg_solve()
+            
+        elif self.reg_type == 'quantile' or self.reg_type == 'env':
+            
+            # Lookup table of param2 quantile (or min) in equal-count bins of param1
+            if self.reg_type == 'env':
+                q = 0.0
+            else:
+                q = self.reg_quantile
+            
+            i  = np.argsort( X , kind = 'stable' )
+            Xs = X[i]
+            Ys = Y[i]
+            
+            bins = np.array_split( np.arange( n ) , min( self.reg_bins , n ) )
+            
+            self.reg_x = np.array([ np.median( Xs[j] ) for j in bins ])
+            self.reg_y = np.array([ np.quantile( Ys[j] , q ) for j in bins ])
+            
+            if self.reg_monotone:
+                # Direction given by the sign of the linear trend
+                if np.dot( X - X.mean() , Y - Y.mean() ) >= 0:
+                    self.reg_y = np.maximum.accumulate( self.reg_y )
+                else:
+                    self.reg_y = np.minimum.accumulate( self.reg_y )
+                
+            print('Reg. results: x=', self.reg_x, ' y=', self.reg_y)
+            
+        # New regression results
+        self.reg_version = next( _reg_versions )
+        
+        
+    ############################
+    def lin_reg_solve(self):
+        """ linear regression parameters from sufficient statistics """
+        
+        P = np.linalg.inv( self.reg_S )
+        
+        self.theta = np.dot( P , self.reg_b )
+        
+        # Parameters covariance from residuals
+        e2 = self.reg_yy - 2 * np.dot( self.theta , self.reg_b ) + np.dot( self.theta , np.dot( self.reg_S , self.theta ) )
+        s2 = max( e2 , 0 ) / max( self.reg_n - 2 , 1 )
+        
+        self.theta_cov = s2 * P
+        
+        print('Reg. results: slope=', self.theta[0], ' offset=', self.theta[1])
+        
+        
+    ############################
+    def update_regression(self, x , y ):
+        """ update regression with new points of the analysis domain """
+        
+        if self.reg_type == 'lin':
+            
+            X = np.array( x )
+            Y = np.array( y )
+            
+            Phi = np.array([ X , np.ones( len( X ) ) ])
+            
+            self.reg_S  = self.reg_S  + np.dot( Phi , Phi.T )
+            self.reg_b  = self.reg_b  + np.dot( Phi , Y )
+            self.reg_yy = self.reg_yy + np.dot( Y , Y )
+            self.reg_n  = self.reg_n  + len( X )
+            
+            self.lin_reg_solve()
+            
+            # New regression results
+            self.reg_version = next( _reg_versions )
+            
+        else:
+            
+            # Lookup tables depend on all points
+            self.compute_regression()
+            
+            
+    ############################
+    def reg_curve(self, n = 10 ):
+        """ regression curve over the analysis domain """
+        
+        X = np.array(self.x)
+        
+        x = np.linspace( X.min() , X.max(), num=n)
+        y = self.reg_map(x)
+        
+        return x , y
+    
+    
+    ############################
+    def update_analysis(self):
+        """ 
+        incremental analysis of motors appended to the data file
+        ----------------------------------------------------------
+        returns True if the domain of the last analysis changed, in which
+        case the regression and figure are updated
+        """
+        
+        with open( self.filename , 'rb' ) as f:
+            size = os.fstat( f.fileno() ).st_size
+            sig  = self.file_signature( f )
+        
+        # Rows already loaded were replaced, moved or removed
+        rewritten = size < self.file_pos or not sig == self.file_sig
+        
+        if size == self.file_pos and not rewritten:
+            # No new data
+            return False
+        
+        if rewritten or self.file_partial:
+            # File was rewritten, or last row was loaded while being written
+            self.load_motors_data( self.filename , partial = False )
+            
+            if hasattr( self , 'analysis' ):
+                
+                if 'fig' in self.__dict__:
+                    plt.close( self.fig )
+                    
+                self.two_axis_analysis( *self.analysis )
+                
+            return True
+            
+        new_motors = self.load_new_motors_data()
+        
+        if not hasattr( self , 'analysis' ):
+            return False
+        
+        param1 , param2 , plot , reg = self.analysis
+        
+        new_motors = [ m for m in new_motors if self.motor_meet_criteria( m , param1 , param2 ) ]
+        
+        if not new_motors:
+            # Domain of analysis did not changed
+            return False
+        
+        x = [ m.specs[param1][0] for m in new_motors ]
+        y = [ m.specs[param2][0] for m in new_motors ]
+        
+        self.x.extend( x )
+        self.y.extend( y )
+        
+        print('Number of motor in analysis domain: ', self.x.__len__( ) )
+        
+        if reg:
+            self.update_regression( x , y )
+            
+        if plot:
+            
+            for m in new_motors:
+                marker_type, color_type = self.motortype2marker( m.specs['typ'][0] )
+                self.plot.plot( [ m.specs[param1][0] ] , [ m.specs[param2][0] ] , marker=marker_type, markersize=3, color=color_type)
+                
+            if reg:
+                self.reg_line.set_data( *self.reg_curve() )
+                
+            self.plot.relim()
+            self.plot.autoscale_view()
+            plt.draw()
+            
+            if self.save:
+                self.save_figure()
+                
+        return True
+    
+    
+    ############################
+    def watch(self, period = 1.0 , duration = None , callback = None ):
+        """ 
+        watch the data file and update analysis when motors are appended
+        ------------------------------------------------------------------
+        callback(self) is called after each update, watch until duration
+        (sec) if not None
+        """
+        
+        _watch( self , period , duration , callback )
+        
+        
     ############################
     def reg_map(self, x):  
         """ Foward computation using regression """
@@ -256,7 +565,43 @@ class MotorAnalyzer:
             
             y = self.theta[0] * x + self.theta[1]
             
+        elif self.reg_type == 'quantile' or self.reg_type == 'env':
+            
+            # Binary search of the table segment, linear interpolation
+            # (constant end values outside of the table)
+            xp = self.reg_x
+            yp = self.reg_y
+            
+            if len( xp ) == 1:
+                
+                y = yp[0] + 0.0 * np.asarray( x , dtype = float )
+                
+            else:
+                
+                x  = np.clip( x , xp[0] , xp[-1] )
+                i  = np.clip( np.searchsorted( xp , x ) , 1 , len( xp ) - 1 )
+                
+                x0 = xp[ i - 1 ]
+                x1 = xp[ i ]
+                y0 = yp[ i - 1 ]
+                y1 = yp[ i ]
+                
+                dx    = x1 - x0
+                slope = np.where( dx > 0 , ( y1 - y0 ) / np.where( dx > 0 , dx , 1.0 ) , 0.0 )
+                
+                y = y0 + slope * ( x - x0 )
+            
         return y
+    
+    ############################
+    def reg_state(self):  
+        """ Hashable state of catalog data, filters and regression model """
+        
+        active_range = tuple( tuple( r ) for r in self.active_range )
+        
+        reg_params   = ( self.reg_type , self.reg_bins , self.reg_quantile , self.reg_monotone )
+        
+        return ( self.reg_version , ) + reg_params + ( self.active_type , active_range )
         
     ############################
     def motor_meet_criteria(self, motor , param1, param2):
@@ -333,6 +678,46 @@ class MotorAnalyzer:
 '''
 
 
+# Monte Carlo worker state (one analyzer copy per process)
+_mc_analyzer = None
+
+
+############################
+def _mc_init( analyzer ):
+    """ set analyzer used by Monte Carlo workers """
+    
+    global _mc_analyzer
+    
+    _mc_analyzer = analyzer
+    
+    
+############################
+def _mc_run( task ):
+    """ compute one chunk of Monte Carlo samples """
+    
+    lam , n , seed , k , edges = task
+    
+    rng = np.random.default_rng( [ seed , k ] )
+    
+    return _mc_analyzer.mc_compute_chunk( lam , n , rng , edges )
+
+
+############################
+def _mc_reduce( results ):
+    """ sum Monte Carlo chunks results """
+    
+    tot = None
+    
+    for r in results:
+        if tot is None:
+            tot = r
+        else:
+            for k in tot:
+                tot[k] = tot[k] + r[k]
+                
+    return tot
+
+
 
 class DsdmSimpleAnalyzer:
     
@@ -360,10 +745,100 @@ class DsdmSimpleAnalyzer:
         self.output_path   = '../output/'
         self.analysis_name = 'Simple dsdm vs. single motor analysis '
         
+        self.init_cache()
         self.compute_hf_req() # based on lambda
         self.compute_regressions()
         
         
+    ############################
+    def __getstate__( self ):
+        """ figures are not copied with the analyzer """
+        
+        return _state_without( self , [ 'fig' , 'plots' ] )
+        
+        
+    ############################
+    def init_cache( self , size = 1000 ):
+        """ Bounded memoization of specs computation """
+        
+        self.cache_size   = size
+        self.cache        = collections.OrderedDict()
+        self.cache_state  = None
+        self.cache_hits   = 0
+        self.cache_misses = 0
+        
+        
+    ############################
+    def cache_key( self ):
+        """ requirements defining the specs """
+        
+        return ( self.hs_tor , self.hs_vel , self.hf_tor , self.hf_vel )
+    
+    
+    ############################
+    def regressions_state( self ):
+        """ state of regressions used by the specs computation """
+        
+        return ( self.A_tor.reg_state() , self.A_pri.reg_state() , self.A_kin.reg_state() )
+    
+    
+    ############################
+    def cache_info( self ):
+        """ hit/miss counters of the specs cache """
+        
+        info = {}
+        
+        info['hits']   = self.cache_hits
+        info['misses'] = self.cache_misses
+        info['size']   = len( self.cache )
+        info['max']    = self.cache_size
+        
+        return info
+    
+    
+    ############################
+    def compute_specs( self ):
+        """ single and dsdm specs of actual requirements, memoized """
+        
+        # Invalidate results if catalog, filters or regressions changed
+        state = self.regressions_state()
+        
+        if not state == self.cache_state:
+            self.cache.clear()
+            self.cache_state = state
+        
+        key = self.cache_key()
+        
+        if not all( np.ndim( k ) == 0 for k in key ):
+            
+            # Arrays of requirements are not memoized
+            self.single_compute_specs()
+            self.dsdm_compute_specs()
+            
+        elif key in self.cache:
+            
+            self.cache_hits = self.cache_hits + 1
+            self.cache.move_to_end( key )
+            
+            single_specs , dsdm_specs = self.cache[ key ]
+            
+            self.single_specs = list( single_specs )
+            self.dsdm_specs   = list( dsdm_specs )
+            
+        else:
+            
+            self.cache_misses = self.cache_misses + 1
+            
+            self.single_compute_specs()
+            self.dsdm_compute_specs()
+            
+            self.cache[ key ] = ( tuple( self.single_specs ) , tuple( self.dsdm_specs ) )
+            
+            # Drop least recently used
+            if len( self.cache ) > self.cache_size:
+                self.cache.popitem( last = False )
+        
+        
     ############################
     def compute_hf_req( self ):
         """ based on lambda """
@@ -431,18 +906,315 @@ class DsdmSimpleAnalyzer:
         self.lam = lam
         
         self.compute_hf_req()
-        self.single_compute_specs()
-        self.dsdm_compute_specs()
+        self.compute_specs()
         
         res = [ self.single_specs , self.dsdm_specs ]
         
         return res
         
         
+    ############################
+    def spec_index( self , spec = 'mas' ):
+        """ position of a spec in single_specs and dsdm_specs lists """
+        
+        return [ 'mas' , 'pri' , 'kin' ].index( spec )
+    
+    
+    ############################
+    def specs_are_linear( self ):
+        """ check if specs are linear functions of the requirements """
+        
+        regs = [ self.A_tor , self.A_pri , self.A_kin ]
+        
+        return all( A.reg_type == 'lin' for A in regs )
+        
+        
+    ############################
+    def vector_compute_specs( self , hs_tor , hs_vel , lam ):
+        """ 
+        Specs for arrays of requirements (no memoization)
+        ---------------------------------------------------
+        hs_tor, hs_vel and lam are broadcasted together, actual
+        requirements of the analyzer are left unchanged
+        """
+        
+        names = [ 'hs_tor' , 'hs_vel' , 'lam' , 'hf_tor' , 'hf_vel' , 'single_specs' , 'dsdm_specs' ]
+        saved = { k : self.__dict__[k] for k in names if k in self.__dict__ }
+        
+        try:
+            
+            hs_tor , hs_vel , lam = np.broadcast_arrays( np.asarray( hs_tor , dtype = float ) ,
+                                                         np.asarray( hs_vel , dtype = float ) ,
+                                                         np.asarray( lam    , dtype = float ) )
+            
+            self.hs_tor = hs_tor
+            self.hs_vel = hs_vel
+            self.lam    = lam
+            
+            self.compute_hf_req()
+            self.single_compute_specs()
+            self.dsdm_compute_specs()
+            
+            single_specs = [ np.broadcast_to( s , lam.shape ) for s in self.single_specs ]
+            dsdm_specs   = [ np.broadcast_to( s , lam.shape ) for s in self.dsdm_specs ]
+            
+        finally:
+            
+            self.__dict__.update( saved )
+            
+        return single_specs , dsdm_specs
+    
+    
+    ############################
+    def break_even_lam( self , hs_tor = None , hs_vel = None , spec = 'mas' , lam_min = 1.0 , lam_max = 100.0 , tol = 1e-6 , n_grid = 100 ):
+        """ 
+        Operating speed ratio where dsdm and single motor specs are equal
+        ------------------------------------------------------------------
+        hs_tor and hs_vel can be arrays of requirements (default to actual
+        requirements). For non-linear regressions, the first sign change
+        of the specs difference on a grid of n_grid lambdas is refined by
+        bisection, nan is returned where no sign change is found in
+        [lam_min, lam_max]
+        """
+        
+        if hs_tor is None:
+            hs_tor = self.hs_tor
+        if hs_vel is None:
+            hs_vel = self.hs_vel
+            
+        i = self.spec_index( spec )
+        
+        def f( lam ):
+            single_specs , dsdm_specs = self.vector_compute_specs( hs_tor , hs_vel , lam )
+            return dsdm_specs[i] - single_specs[i]
+        
+        if self.specs_are_linear():
+            
+            # Closed-form: specs difference is affine in lambda
+            f1 = f( 1.0 )
+            f2 = f( 2.0 )
+            
+            with np.errstate( divide = 'ignore' , invalid = 'ignore' ):
+                lam = 1.0 - f1 / ( f2 - f1 )
+                
+            lam = np.where( ( lam >= lam_min ) & ( lam <= lam_max ) , lam , np.nan )
+            
+        else:
+            
+            # Coarse grid, crossings may be multiple with lookup tables
+            if lam_min > 0:
+                grid = np.geomspace( lam_min , lam_max , n_grid )
+            else:
+                grid = np.linspace( lam_min , lam_max , n_grid )
+                
+            shape = np.broadcast( np.asarray( hs_tor ) , np.asarray( hs_vel ) ).shape
+            
+            F = f( grid.reshape( ( n_grid , ) + ( 1 , ) * len( shape ) ) )
+            
+            change = np.sign( F[:-1] ) * np.sign( F[1:] ) <= 0
+            valid  = change.any( axis = 0 )
+            
+            # First sign change of each requirements set
+            j = np.argmax( change , axis = 0 )
+            
+            a  = grid[ j ]
+            b  = grid[ j + 1 ]
+            fa = np.take_along_axis( F , j[np.newaxis] , axis = 0 )[0]
+            
+            # Vectorized bisection in the sub-brackets
+            n = int( np.ceil( np.log2( np.max( b - a ) / tol ) ) )
+            
+            for k in range( max( n , 1 ) ):
+                
+                c  = 0.5 * ( a + b )
+                fc = f( c )
+                
+                left = np.sign( fc ) == np.sign( fa )
+                
+                a  = np.where( left , c  , a )
+                fa = np.where( left , fc , fa )
+                b  = np.where( left , b  , c )
+                
+            lam = np.where( valid , 0.5 * ( a + b ) , np.nan )
+            
+        if lam.ndim == 0:
+            lam = float( lam )
+            
+        return lam
+        
+        
+    ############################
+    def mc_coefs( self ):
+        """ hand-tuned coefficients sampled in Monte Carlo analysis """
+        
+        return {}
+    
+    
+    ############################
+    def mc_compute_chunk( self , lam , n , rng , edges = None ):
+        """ 
+        Specs for n random samples of the models parameters
+        -----------------------------------------------------
+        Linear regressions parameters are sampled from their estimated
+        covariance and hand-tuned coefficients from a normal distribution
+        with coef_rel_std relative standard deviation. Returns the sums
+        needed to compute means, std, dsdm win probabilities and histograms
+        of the specs difference (dsdm - single) over the edges.
+        """
+        
+        regs  = [ self.A_tor , self.A_pri , self.A_kin ]
+        regs  = [ A for A in regs if A.reg_type == 'lin' ] # sampled regressions
+        theta = [ A.theta for A in regs ]
+        coefs = self.mc_coefs()
+        
+        try:
+            
+            for A in regs:
+                th      = rng.multivariate_normal( A.theta , A.theta_cov , n )
+                A.theta = ( th[:,0] , th[:,1] )
+                    
+            for k , c in coefs.items():
+                setattr( self , k , np.maximum( rng.normal( c , abs( c ) * self.coef_rel_std , n ) , 0 ) )
+                
+            lam = np.full( n , lam , dtype = float )
+            
+            single_specs , dsdm_specs = self.vector_compute_specs( self.hs_tor , self.hs_vel , lam )
+            
+        finally:
+            
+            for A , th in zip( regs , theta ):
+                A.theta = th
+                
+            for k , c in coefs.items():
+                setattr( self , k , c )
+            
+        single = np.array( single_specs )
+        dsdm   = np.array( dsdm_specs )
+        diff   = dsdm - single
+        
+        res = {}
+        
+        res['n']            = n
+        res['single_sum']   = single.sum( axis = 1 )
+        res['single_sum2']  = ( single**2 ).sum( axis = 1 )
+        res['dsdm_sum']     = dsdm.sum( axis = 1 )
+        res['dsdm_sum2']    = ( dsdm**2 ).sum( axis = 1 )
+        res['dsdm_wins']    = ( diff < 0 ).sum( axis = 1 )
+        
+        if edges is not None:
+            # Out of range samples are counted in first and last bins
+            res['hist'] = np.array( [ np.histogram( np.clip( diff[i] , e[0] , e[-1] ) , e )[0] for i , e in enumerate( edges ) ] )
+        else:
+            res['diff'] = diff
+            
+        return res
+    
+    
+    ############################
+    def mc_compare_lam( self , lam = None , n_samples = 100000 , chunk_size = 100000 , n_jobs = 1 , seed = 0 , bins = 50 ):
+        """ 
+        Monte Carlo propagation of models uncertainty
+        -----------------------------------------------
+        Samples are processed in chunks of chunk_size, in parallel over
+        n_jobs processes, so memory does not grow with n_samples. Results
+        are independent of n_jobs for a given seed.
+        """
+        
+        if lam is None:
+            lam = self.lam
+            
+        model = copy.deepcopy( self )
+        
+        # Histograms edges from a pilot run
+        pilot = model.mc_compute_chunk( lam , min( chunk_size , n_samples , 10000 ) , np.random.default_rng( [ seed , 0 ] ) )
+        edges = []
+        
+        for d in pilot['diff']:
+            lo , hi = d.min() , d.max()
+            pad     = 0.1 * ( hi - lo ) if hi > lo else 1.0
+            edges.append( np.linspace( lo - pad , hi + pad , bins + 1 ) )
+        
+        n_chunks = int( np.ceil( n_samples * 1.0 / chunk_size ) )
+        tasks    = []
+        
+        for k in range( n_chunks ):
+            n = min( chunk_size , n_samples - k * chunk_size )
+            tasks.append( ( lam , n , seed , k + 1 , edges ) )
+        
+        if n_jobs == 1:
+            
+            _mc_init( model )
+            
+            try:
+                tot = _mc_reduce( map( _mc_run , tasks ) )
+            finally:
+                # Release the analyzer copy
+                _mc_init( None )
+            
+        else:
+            
+            with multiprocessing.Pool( n_jobs , initializer = _mc_init , initargs = ( model , ) ) as pool:
+                tot = _mc_reduce( pool.imap_unordered( _mc_run , tasks ) )
+        
+        n = tot['n']
+        
+        res = {}
+        
+        res['n']           = n
+        res['single_mean'] = tot['single_sum'] / n
+        res['single_std']  = np.sqrt( np.maximum( tot['single_sum2'] / n - res['single_mean']**2 , 0 ) )
+        res['dsdm_mean']   = tot['dsdm_sum'] / n
+        res['dsdm_std']    = np.sqrt( np.maximum( tot['dsdm_sum2'] / n - res['dsdm_mean']**2 , 0 ) )
+        res['p_dsdm_wins'] = tot['dsdm_wins'] * 1.0 / n
+        res['diff_hist']   = tot['hist']
+        res['diff_edges']  = np.array( edges )
+        
+        return res
+        
+        
+    ############################
+    def update_analysis( self ):
+        """ 
+        incremental update with motors appended to the data file
+        -----------------------------------------------------------
+        only regressions whose domain changed are updated, specs and
+        figure are recomputed if any regression changed
+        """
+        
+        regs    = [ self.A_tor , self.A_pri , self.A_kin ]
+        changed = [ A.update_analysis() for A in regs ]
+        
+        if not any( changed ):
+            return False
+        
+        # Cache is invalidated by the new regressions state
+        self.compute_specs()
+        
+        if 'fig' in self.__dict__:
+            plt.close( self.fig )
+            self.plot_analysis( self.plot_lam_max )
+            
+        return True
+    
+    
+    ############################
+    def watch( self , period = 1.0 , duration = None , callback = None ):
+        """ 
+        watch the data file and update analysis when motors are appended
+        ------------------------------------------------------------------
+        callback(self) is called after each update, watch until duration
+        (sec) if not None
+        """
+        
+        _watch( self , period , duration , callback )
+        
+        
     ############################
     def plot_analysis( self , lam_max = 10 , ):
         """ """
         
+        self.plot_lam_max = lam_max
+        
         n = 10
         x = np.linspace( 1 , lam_max, num=n)
         
@@ -535,6 +1307,18 @@ class DsdmImprovedAnalyzer( DsdmSimpleAnalyzer ):
         self.output_path   = '../output/'
         self.analysis_name = 'Improved dsdm vs. single motor analysis '
         
+        # Gearbox Params
+        self.max_motor_vel = 10000.0 # RPM
+        self.gear_opt      = None    # None: max ratio, 'mas' or 'pri': optimal ratio
+        
+        # Gearbox and brake models Params
+        self.gear_mas_coef  = 0.1  # mass per torque
+        self.gear_pri_coef  = 0.20 # 20% of motor price
+        self.brake_mas_coef = 0.2  # mass per torque
+        self.brake_pri_coef = 0.20 # 20% of motor price
+        self.coef_rel_std   = 0.20 # uncertainty for Monte Carlo analysis
+        
+        self.init_cache()
         self.input_torque_speed_req()
         self.compute_regressions()
         
@@ -560,8 +1344,8 @@ class DsdmImprovedAnalyzer( DsdmSimpleAnalyzer ):
         
         #TODO base on real data
         
-        mas = 0.1 * tor
-        pri = self.A_pri.reg_map( tor ) * 0.20 # 20% of motor price
+        mas = self.gear_mas_coef * tor
+        pri = self.A_pri.reg_map( tor ) * self.gear_pri_coef
         kin = 0 # neglect
         
         return mas, pri, kin
@@ -573,18 +1357,181 @@ class DsdmImprovedAnalyzer( DsdmSimpleAnalyzer ):
         
         #TODO base on real data
         
-        mas = 0.2 * tor
-        pri = self.A_pri.reg_map( tor ) * 0.20 # 20% of motor price
+        mas = self.brake_mas_coef * tor
+        pri = self.A_pri.reg_map( tor ) * self.brake_pri_coef
         kin = 0 # neglect
         
         return mas, pri, kin
     
         
+    ############################
+    def cache_key( self ):
+        """ requirements and gearbox params defining the specs """
+        
+        key = DsdmSimpleAnalyzer.cache_key( self )
+        
+        coefs = tuple( self.mc_coefs().values() )
+        
+        return key + ( self.max_motor_vel , self.gear_opt ) + coefs
+    
+    
+    ############################
+    def mc_coefs( self ):
+        """ hand-tuned coefficients sampled in Monte Carlo analysis """
+        
+        coefs = {}
+        
+        coefs['gear_mas_coef']  = self.gear_mas_coef
+        coefs['gear_pri_coef']  = self.gear_pri_coef
+        coefs['brake_mas_coef'] = self.brake_mas_coef
+        coefs['brake_pri_coef'] = self.brake_pri_coef
+        
+        return coefs
+    
+    
+    ############################
+    def motor_req2spec( self , tor ):
+        """ """
+        
+        mas = self.A_tor.reg_map( tor )
+        pri = self.A_pri.reg_map( tor )
+        kin = self.A_kin.reg_map( tor )
+        
+        return mas, pri, kin
+    
+    
+    ############################
+    def drive_req2spec( self , tor , ratio , spec = 'mas' , gear_tor = None , brake = False ):
+        """ 
+        spec of a motor and gearbox sustaining tor at the output
+        ----------------------------------------------------------
+        gear_tor is the torque the gearbox (and brake) is sized for, tor
+        by default, brake adds a brake on the motor side of the gearbox
+        """
+        
+        if gear_tor is None:
+            gear_tor = tor
+            
+        i = self.spec_index( spec )
+        
+        m_specs = self.motor_req2spec( tor * 1.0 / ratio )
+        g_specs = self.gear_req2spec( gear_tor , ratio )
+        
+        s = m_specs[i] + g_specs[i]
+        
+        if brake:
+            s = s + self.brake_req2spec( gear_tor * 1.0 / ratio )[i]
+            
+        return s
+    
+    
+    ############################
+    def optimal_gear_ratio( self , tor , vel , spec = 'mas' , r_min = 1.0 , tol = 1e-6 , gear_tor = None , brake = False ):
+        """ 
+        Gear ratio minimizing the mass or price of a drive
+        ----------------------------------------------------
+        tor and vel are the output torque and speed requirements (can be
+        arrays), the ratio is bounded by r_min and the max motor velocity,
+        gear_tor and brake define the drive as in drive_req2spec.
+        With the actual gearbox model, independent of the ratio, and
+        monotone regressions the optimum is a bound (the max ratio for
+        increasing regressions)
+        """
+        
+        tor , vel = np.broadcast_arrays( np.asarray( tor , dtype = float ) ,
+                                         np.asarray( vel , dtype = float ) )
+        
+        r_max = self.max_motor_vel / vel
+        r_min = np.minimum( r_min , r_max )
+        
+        c_min = self.drive_req2spec( tor , r_min , spec , gear_tor , brake )
+        c_max = self.drive_req2spec( tor , r_max , spec , gear_tor , brake )
+        
+        if self.specs_are_linear():
+            
+            # Closed-form: spec is affine in 1/ratio, optimum is a bound
+            ratio = np.where( c_max <= c_min , r_max , r_min )
+            
+        else:
+            
+            # Vectorized golden-section search on [r_min, r_max]
+            g = ( np.sqrt( 5.0 ) - 1.0 ) * 0.5
+            
+            a = r_min
+            b = r_max
+            
+            c = b - g * ( b - a )
+            d = a + g * ( b - a )
+            
+            fc = self.drive_req2spec( tor , c , spec , gear_tor , brake )
+            fd = self.drive_req2spec( tor , d , spec , gear_tor , brake )
+            
+            n = int( np.ceil( np.log( max( np.max( r_max - r_min ) , tol ) / tol ) / np.log( 1.0 / g ) ) )
+            
+            for k in range( n ):
+                
+                # minimum is in [a, d] if left, else in [c, b]
+                left = fc < fd
+                
+                a_new = np.where( left , a , c )
+                b_new = np.where( left , d , b )
+                
+                # only one new interior point to evaluate
+                e  = np.where( left , b_new - g * ( b_new - a_new ) , a_new + g * ( b_new - a_new ) )
+                fe = self.drive_req2spec( tor , e , spec , gear_tor , brake )
+                
+                c_new  = np.where( left , e  , d  )
+                fc_new = np.where( left , fe , fd )
+                d_new  = np.where( left , c  , e  )
+                fd_new = np.where( left , fc , fe )
+                
+                a , b , c , d , fc , fd = a_new , b_new , c_new , d_new , fc_new , fd_new
+                
+            ratio = 0.5 * ( a + b )
+            
+            # optimum can be at a bound
+            c_opt = self.drive_req2spec( tor , ratio , spec , gear_tor , brake )
+            ratio = np.where( c_min < c_opt , r_min , ratio )
+            c_opt = np.minimum( c_min , c_opt )
+            ratio = np.where( c_max < c_opt , r_max , ratio )
+            
+        if ratio.ndim == 0:
+            ratio = float( ratio )
+            
+        return ratio
+    
+    
+    ############################
+    def gear_ratio( self , tor , vel , gear_tor = None , brake = False ):
+        """ gear ratio of a drive sustaining tor at vel at the output """
+        
+        if self.gear_opt is None:
+            
+            ratio = self.max_motor_vel / vel
+            
+        else:
+            
+            ratio = self.optimal_gear_ratio( tor , vel , self.gear_opt , gear_tor = gear_tor , brake = brake )
+            
+        return ratio
+    
+    
+    ############################
+    def optimal_gear_ratios( self , spec = 'mas' ):
+        """ optimal gear ratios of single motor and dsdm (m1, m2) drives """
+        
+        r  = self.optimal_gear_ratio( self.hf_tor , self.hs_vel , spec )
+        r1 = self.optimal_gear_ratio( self.hs_tor , self.hs_vel , spec , gear_tor = self.hf_tor , brake = True )
+        r2 = self.optimal_gear_ratio( self.hf_tor , self.hf_vel , spec )
+        
+        return r , r1 , r2
+        
+        
     ############################
     def single_compute_specs( self ):
         """ """
         # gearbox
-        ratio               = 10000.0 / self.hs_vel
+        ratio               = self.gear_ratio( self.hf_tor , self.hs_vel )
         g_mas, g_pri, g_kin = self.gear_req2spec( self.hf_tor , ratio )
         
         # motor
@@ -605,11 +1552,11 @@ class DsdmImprovedAnalyzer( DsdmSimpleAnalyzer ):
     def dsdm_compute_specs( self ):
         """ """
         # gearbox m1 
-        r1                     = 10000.0 / self.hs_vel
+        r1                     = self.gear_ratio( self.hs_tor , self.hs_vel , self.hf_tor , True )
         g1_mas, g1_pri, g1_kin = self.gear_req2spec( self.hf_tor , r1 ) # assume both need to sustain hf_tor
         
         # gearbox m2 
-        r2                     = 10000.0 / self.hf_vel
+        r2                     = self.gear_ratio( self.hf_tor , self.hf_vel )
         g2_mas, g2_pri, g2_kin = self.gear_req2spec( self.hf_tor , r2 ) # assume both need to sustain hf_tor
         
         # brake 
@@ -27,6 +27,11 @@ a2 = 'mas'
 # a2 = 'vol'
 # a2 = 'kin'
 
+""" Regression """
+# A.reg_type = 'quantile'
+# A.reg_quantile = 0.1
+# A.reg_type = 'env'
+
 """ Domain """
 # A.active_range[0] = [5,80]
 # A.active_type = 'RE'
@@ -0,0 +1,35 @@
+
+import motors as m
+import numpy as np
+
+B = m.DsdmImprovedAnalyzer()
+
+""" Lookup-table regressions """
+
+for A, a2 in [ ( B.A_tor , 'mas' ) , ( B.A_pri , 'pri' ) , ( B.A_kin , 'kin' ) ]:
+    A.save         = False
+    A.reg_type     = 'quantile'
+    A.reg_quantile = 0.1
+    A.two_axis_analysis( 'tor' , a2 , reg = True )
+
+""" Break-even lambda vs. brute-force scan """
+
+lam = np.linspace( 1 , 100 , 20000 )
+
+for spec in [ 'mas' , 'pri' ]:
+
+    i = B.spec_index( spec )
+
+    single_specs , dsdm_specs = B.vector_compute_specs( B.hs_tor , B.hs_vel , lam )
+
+    d     = dsdm_specs[i] - single_specs[i]
+    cross = lam[ 1: ][ np.sign( d[:-1] ) * np.sign( d[1:] ) <= 0 ]
+
+    l = B.break_even_lam( spec = spec )
+
+    print( spec , 'scan: ' , cross , ' solver: ' , l )
+
+    if len( cross ) > 0:
+        assert abs( l - cross[0] ) < lam[1] - lam[0]
+    else:
+        assert np.isnan( l )